@@ -2,9 +2,15 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import os
+import re
 import shutil
+import struct
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import sys
@@ -13,17 +19,147 @@ ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT / "src"))
 
 
+_SOURCE_TABLES = (
+    "icustays",
+    "chartevents",
+    "inputevents",
+    "admissions",
+    "patients",
+    "labevents",
+    "d_labitems",
+    "prescriptions",
+    "diagnoses_icd",
+)
+
+# Row filters applied at ingest. The cached source tables only hold these rows, so the filters (and the
+# itemid lists the analysis SQL relies on) are fingerprinted into _source_archive; see _ingest_spec().
+_LABEVENTS_FILTER = (
+    "valuenum is not null\n"
+    "              and itemid in (50811, 51222, 51640, 51265, 53189, 51237, 51675, 50912, 52546, 50813, 52442, 53154)"
+)
+_CHARTEVENTS_FILTER = "itemid in (223848, 223849, 229314) and value is not null"
+_INPUTEVENTS_FILTER = "itemid in (220996, 225168, 226368, 227070)"
+
+_ANALYSIS_SQL_PATH = ROOT / "sql" / "mimic" / "build_analysis_table.sql"
+_ITEMID_LIST_RE = re.compile(r"itemid\s+in\s*\(([^)]*)\)", re.IGNORECASE)
+
+
+def _ingest_spec(analysis_sql: str) -> str:
+    """Fingerprint of what the cached source tables were filtered on.
+
+    Covers the ingest row filters and every `itemid in (...)` list of the analysis SQL, so editing either
+    invalidates a cache that no longer holds the rows the cohort query needs.
+    """
+    sql_itemids = [" ".join(m.split()) for m in _ITEMID_LIST_RE.findall(analysis_sql)]
+    spec = {
+        "labevents": _LABEVENTS_FILTER,
+        "chartevents": _CHARTEVENTS_FILTER,
+        "inputevents": _INPUTEVENTS_FILTER,
+        "analysis_sql_itemids": sql_itemids,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
 def _sql_string_literal(path: Path) -> str:
     # DuckDB doesn't support prepared parameters for CREATE VIEW statements.
     return "'" + str(path).replace("'", "''") + "'"
 
 
 def _extract_member(zf: zipfile.ZipFile, member: str, dest: Path) -> None:
+    """Extract one member unless the cached copy already matches it.
+
+    A `<dest>.meta` sidecar records the member's CRC-32 and size once the extracted bytes have been
+    checked against them (zf.open() checks the CRC itself; the sendfile path and adopted pre-sidecar
+    copies are hashed with zlib.crc32). A rerun then validates the cache without hashing or extracting.
+    """
+    info = zf.getinfo(member)
+    meta = dest.with_name(dest.name + ".meta")
+    stamp = f"{info.CRC:08x} {info.file_size}\n"
+    try:
+        size = os.stat(dest).st_size
+    except FileNotFoundError:
+        size = None
+    # The sidecar only vouches for a copy that is still there at the recorded size.
+    if size == info.file_size:
+        try:
+            if meta.read_text() == stamp:
+                return
+        except FileNotFoundError:
+            # Caches written before the sidecar existed: adopt them once their CRC has been verified.
+            if info.file_size > 0 and _file_crc32(dest) == info.CRC:
+                meta.write_text(stamp)
+                return
     dest.parent.mkdir(parents=True, exist_ok=True)
-    if dest.exists() and dest.stat().st_size > 0:
-        return
-    with zf.open(member) as src, dest.open("wb") as dst:
-        shutil.copyfileobj(src, dst)
+    meta.unlink(missing_ok=True)
+    if info.file_size == 0:
+        dest.touch()
+    elif info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1 and sys.platform == "linux":
+        _sendfile_stored_member(zf, info, dest)
+        if _file_crc32(dest) != info.CRC:
+            dest.unlink()
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+    else:
+        # 1 MiB copy buffer: ZipExtFile has no fd, so shutil's zero-copy fast path never applies.
+        with zf.open(member) as src, dest.open("wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    meta.write_text(stamp)
+
+
+def _file_crc32(path: Path) -> int:
+    crc = 0
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _sendfile_stored_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, dest: Path) -> None:
+    """Copy an uncompressed member (the .csv.gz files are usually STORED) kernel-side with sendfile.
+
+    Unlike zf.open(), this does not check the member CRC; _extract_member verifies the copy afterwards.
+    """
+    with open(zf.filename, "rb") as src:
+        src.seek(info.header_offset)
+        header = src.read(30)
+        if header[:4] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        offset = info.header_offset + 30 + name_len + extra_len
+        remaining = info.file_size
+        os.posix_fadvise(src.fileno(), offset, remaining, os.POSIX_FADV_SEQUENTIAL)
+        with dest.open("wb") as dst:
+            while remaining:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, remaining)
+                if sent == 0:
+                    raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+                offset += sent
+                remaining -= sent
+
+
+def _archive_stamp(zip_path: Path) -> tuple[int, int] | None:
+    try:
+        st = os.stat(zip_path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _cached_archive_stamp(duckdb, db_path: Path) -> tuple[int, int, str] | None:
+    """(size, mtime_ns, ingest_spec) the cached source tables were ingested with, if complete."""
+    if str(db_path) == ":memory:" or not db_path.exists():
+        return None
+    with duckdb.connect(str(db_path), read_only=True) as con:
+        names = {r[0] for r in con.execute("select table_name from duckdb_tables();").fetchall()}
+        if not names.issuperset(_SOURCE_TABLES) or "_source_archive" not in names:
+            return None
+        try:
+            size, mtime_ns, spec = con.execute(
+                "select zip_size, zip_mtime_ns, ingest_spec from _source_archive;"
+            ).fetchone()
+        except duckdb.Error:
+            # Caches written before ingest_spec was recorded.
+            return None
+    return int(size), int(mtime_ns), str(spec)
 
 
 def parse_args() -> argparse.Namespace:
@@ -45,7 +181,28 @@ def parse_args() -> argparse.Namespace:
         default=str(ROOT / "data" / "raw" / "cache" / "mimic-iv-3.1"),
         help="Cache dir for extracted .csv.gz members (gitignored).",
     )
-    p.add_argument("--threads", type=int, default=4, help="DuckDB threads.")
+    p.add_argument(
+        "--duckdb-cache",
+        default=None,
+        help=(
+            "DuckDB database holding the ingested source tables (default: <cache>/mimic_sources.duckdb). "
+            "Reused across runs and landmarks while the archive's size/mtime match. Use :memory: to disable."
+        ),
+    )
+    p.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help=(
+            "DuckDB threads (default: CPU count, capped at 32; scans stop scaling and start contending "
+            "on shared state beyond that)."
+        ),
+    )
+    p.add_argument(
+        "--memory-limit",
+        default=None,
+        help="DuckDB memory_limit (e.g. 8GB). Default: DuckDB's own limit (80%% of RAM). Overflow spills under --cache.",
+    )
     p.add_argument(
         "--landmark-hours",
         type=int,
@@ -56,7 +213,7 @@ def parse_args() -> argparse.Namespace:
     p.add_argument(
         "--no-validate",
         action="store_true",
-        help="Skip running scripts/validate_analysis_table.py after export.",
+        help="Skip validating the exported table (dlfx.study.validate_analysis_table) after export.",
     )
     return p.parse_args()
 
@@ -68,6 +225,8 @@ def main() -> None:
         raise SystemExit(f"duckdb is required. Install with: pip install -r requirements.txt\nError: {e}")
 
     args = parse_args()
+    if args.threads is None:
+        args.threads = min(32, os.cpu_count() or 4)
     landmark_hours = int(args.landmark_hours)
     if landmark_hours <= 0 or landmark_hours > 72:
         raise SystemExit("--landmark-hours must be in [1, 72].")
@@ -75,240 +234,359 @@ def main() -> None:
     out_path = Path(args.out)
     cache_dir = Path(args.cache)
 
-    if not zip_path.exists():
-        raise SystemExit(f"Missing archive: {zip_path}")
-
-    required = [
-        "mimic-iv-3.1/icu/icustays.csv.gz",
-        "mimic-iv-3.1/icu/chartevents.csv.gz",
-        "mimic-iv-3.1/icu/inputevents.csv.gz",
-        "mimic-iv-3.1/hosp/admissions.csv.gz",
-        "mimic-iv-3.1/hosp/patients.csv.gz",
-        "mimic-iv-3.1/hosp/labevents.csv.gz",
-        "mimic-iv-3.1/hosp/d_labitems.csv.gz",
-        "mimic-iv-3.1/hosp/prescriptions.csv.gz",
-        "mimic-iv-3.1/hosp/diagnoses_icd.csv.gz",
-    ]
-
-    with zipfile.ZipFile(zip_path) as zf:
-        names = set(zf.namelist())
-        missing = [m for m in required if m not in names]
-        if missing:
-            raise SystemExit(f"Archive missing required members: {missing}")
-
-        for m in required:
-            dest = cache_dir / m.replace("mimic-iv-3.1/", "")
-            _extract_member(zf, m, dest)
-
-    icu_dir = cache_dir / "icu"
-    hosp_dir = cache_dir / "hosp"
-    icustays = icu_dir / "icustays.csv.gz"
-    chartevents = icu_dir / "chartevents.csv.gz"
-    inputevents = icu_dir / "inputevents.csv.gz"
-    admissions = hosp_dir / "admissions.csv.gz"
-    patients = hosp_dir / "patients.csv.gz"
-    labevents = hosp_dir / "labevents.csv.gz"
-    d_labitems = hosp_dir / "d_labitems.csv.gz"
-    prescriptions = hosp_dir / "prescriptions.csv.gz"
-    diagnoses_icd = hosp_dir / "diagnoses_icd.csv.gz"
-
-    con = duckdb.connect(database=":memory:")
+    db_path = Path(args.duckdb_cache) if args.duckdb_cache else cache_dir / "mimic_sources.duckdb"
+    sql = _ANALYSIS_SQL_PATH.read_text(encoding="utf-8")
+    ingest_spec = _ingest_spec(sql)
+    stamp = _archive_stamp(zip_path)
+    cached = _cached_archive_stamp(duckdb, db_path)
+    # A cache is reused only if it was ingested from this archive with the current row filters.
+    reuse = cached is not None and cached[2] == ingest_spec and (stamp is None or cached[:2] == stamp)
+    if reuse:
+        # Read-only, so several landmark runs can share one ingest concurrently.
+        con = duckdb.connect(str(db_path), read_only=True)
+    else:
+        if stamp is None:
+            raise SystemExit(f"Missing archive: {zip_path}")
+
+        required = [
+            "mimic-iv-3.1/icu/icustays.csv.gz",
+            "mimic-iv-3.1/icu/chartevents.csv.gz",
+            "mimic-iv-3.1/icu/inputevents.csv.gz",
+            "mimic-iv-3.1/hosp/admissions.csv.gz",
+            "mimic-iv-3.1/hosp/patients.csv.gz",
+            "mimic-iv-3.1/hosp/labevents.csv.gz",
+            "mimic-iv-3.1/hosp/d_labitems.csv.gz",
+            "mimic-iv-3.1/hosp/prescriptions.csv.gz",
+            "mimic-iv-3.1/hosp/diagnoses_icd.csv.gz",
+        ]
+
+        # Look the nine members up in ZipFile's name index instead of materializing the full namelist().
+        with zipfile.ZipFile(zip_path) as zf:
+            missing = []
+            for m in required:
+                try:
+                    zf.getinfo(m)
+                except KeyError:
+                    missing.append(m)
+            if missing:
+                raise SystemExit(f"Archive missing required members: {missing}")
+
+        def _extract_one(member: str) -> None:
+            # One ZipFile per task: concurrent reads through a shared handle serialize on its file lock.
+            with zipfile.ZipFile(zip_path) as zf_local:
+                _extract_member(zf_local, member, cache_dir / member.replace("mimic-iv-3.1/", ""))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(len(required), int(args.threads)))) as ex:
+            list(ex.map(_extract_one, required))
+
+        icu_dir = cache_dir / "icu"
+        hosp_dir = cache_dir / "hosp"
+        icustays = icu_dir / "icustays.csv.gz"
+        chartevents = icu_dir / "chartevents.csv.gz"
+        inputevents = icu_dir / "inputevents.csv.gz"
+        admissions = hosp_dir / "admissions.csv.gz"
+        patients = hosp_dir / "patients.csv.gz"
+        labevents = hosp_dir / "labevents.csv.gz"
+        d_labitems = hosp_dir / "d_labitems.csv.gz"
+        prescriptions = hosp_dir / "prescriptions.csv.gz"
+        diagnoses_icd = hosp_dir / "diagnoses_icd.csv.gz"
+
+        if str(db_path) != ":memory:":
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+        con = duckdb.connect(str(db_path))
+
     con.execute(f"PRAGMA threads={int(args.threads)};")
+    if args.memory_limit:
+        con.execute(f"PRAGMA memory_limit={_sql_string_literal(args.memory_limit)};")
+    con.execute(f"PRAGMA temp_directory={_sql_string_literal(cache_dir / 'duckdb_tmp')};")
+    # Row order of the cohort table is not meaningful; dropping it lets scans, joins and the Parquet
+    # writer run without order-preserving buffers.
+    con.execute("PRAGMA preserve_insertion_order=false;")
+    con.execute("PRAGMA disable_progress_bar;")
 
-    icustays_lit = _sql_string_literal(icustays)
-    chartevents_lit = _sql_string_literal(chartevents)
-    inputevents_lit = _sql_string_literal(inputevents)
-    admissions_lit = _sql_string_literal(admissions)
-    patients_lit = _sql_string_literal(patients)
-    labevents_lit = _sql_string_literal(labevents)
-    d_labitems_lit = _sql_string_literal(d_labitems)
-    prescriptions_lit = _sql_string_literal(prescriptions)
-    diagnoses_icd_lit = _sql_string_literal(diagnoses_icd)
-
-    con.execute("create schema if not exists mimiciv_icu;")
-    con.execute("create schema if not exists mimiciv_hosp;")
-
-    # Read only the columns we actually use downstream to keep parsing overhead lower.
-    con.execute(
-        f"""
-        create view mimiciv_icu.icustays as
-        select
-          subject_id::bigint as subject_id,
-          hadm_id::bigint as hadm_id,
-          stay_id::bigint as stay_id,
-          intime::timestamp as intime,
-          outtime::timestamp as outtime
-        from read_csv_auto(
-          {icustays_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true
-        );
-        """,
-    )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.admissions as
-        select
-          subject_id::bigint as subject_id,
-          hadm_id::bigint as hadm_id,
-          admittime::timestamp as admittime,
-          dischtime::timestamp as dischtime,
-          deathtime::timestamp as deathtime,
-          race::varchar as race
-        from read_csv_auto(
-          {admissions_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true
-        );
-        """,
-    )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.patients as
-        select
-          subject_id::bigint as subject_id,
-          gender::varchar as gender,
-          anchor_age::integer as anchor_age,
-          anchor_year::integer as anchor_year,
-          dod::date as dod
-        from read_csv_auto(
-          {patients_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true
-        );
-        """,
-    )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.d_labitems as
-        select
-          itemid::integer as itemid,
-          label::varchar as label
-        from read_csv_auto(
-          {d_labitems_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true
-        );
-        """,
-    )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.labevents as
-        select
-          try_cast(hadm_id as bigint) as hadm_id,
-          try_cast(itemid as integer) as itemid,
-          try_cast(charttime as timestamp) as charttime,
-          try_cast(valuenum as double) as valuenum
-        from read_csv_auto(
-          {labevents_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true,
-          all_varchar=true
-        );
-        """,
-    )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.prescriptions as
-        select
-          hadm_id::bigint as hadm_id,
-          starttime::timestamp as starttime,
-          stoptime::timestamp as stoptime,
-          drug::varchar as drug
-        from read_csv_auto(
-          {prescriptions_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true
-        );
-        """,
-    )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.diagnoses_icd as
-        select
-          hadm_id::bigint as hadm_id,
-          icd_code::varchar as icd_code,
-          icd_version::integer as icd_version
-        from read_csv_auto(
-          {diagnoses_icd_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true
-        );
-        """,
-    )
+    if not reuse:
+        icustays_lit = _sql_string_literal(icustays)
+        chartevents_lit = _sql_string_literal(chartevents)
+        inputevents_lit = _sql_string_literal(inputevents)
+        admissions_lit = _sql_string_literal(admissions)
+        patients_lit = _sql_string_literal(patients)
+        labevents_lit = _sql_string_literal(labevents)
+        d_labitems_lit = _sql_string_literal(d_labitems)
+        prescriptions_lit = _sql_string_literal(prescriptions)
+        diagnoses_icd_lit = _sql_string_literal(diagnoses_icd)
+
+        # All DDL is sent to DuckDB as one script rather than one execute() round trip per table.
+        ddl = [
+            "create schema if not exists mimiciv_icu;",
+            "create schema if not exists mimiciv_hosp;",
+        ]
 
-    # For MV proxy, we only need ventilator mode/type items.
-    con.execute(
-        f"""
-        create view mimiciv_icu.chartevents as
-        select
-          try_cast(stay_id as bigint) as stay_id,
-          try_cast(charttime as timestamp) as charttime,
-          try_cast(itemid as integer) as itemid,
-          value::varchar as value
-        from read_csv_auto(
-          {chartevents_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true
+        # Every source is ingested once into a table of the DuckDB cache, so reruns skip CSV parsing.
+        # Read only the columns we actually use downstream, typed in the CSV reader itself so no outer casts
+        # are needed. Rows whose filter/join columns fail to parse are dropped (ignore_errors) where the
+        # previous try_cast would have nulled them out of every join anyway.
+        ddl.append(
+            f"""
+            create or replace table mimiciv_icu.icustays as
+            select
+              subject_id,
+              hadm_id,
+              stay_id,
+              intime,
+              outtime
+            from read_csv(
+              {icustays_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              parallel=true,
+              types={{
+                'subject_id': 'BIGINT',
+                'hadm_id': 'BIGINT',
+                'stay_id': 'BIGINT',
+                'intime': 'TIMESTAMP',
+                'outtime': 'TIMESTAMP'
+              }}
+            );
+            """,
+        )
+        ddl.append(
+            f"""
+            create or replace table mimiciv_hosp.admissions as
+            select
+              subject_id,
+              hadm_id,
+              admittime,
+              dischtime,
+              deathtime,
+              race
+            from read_csv(
+              {admissions_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              parallel=true,
+              types={{
+                'subject_id': 'BIGINT',
+                'hadm_id': 'BIGINT',
+                'admittime': 'TIMESTAMP',
+                'dischtime': 'TIMESTAMP',
+                'deathtime': 'TIMESTAMP',
+                'race': 'VARCHAR'
+              }}
+            );
+            """,
+        )
+        ddl.append(
+            f"""
+            create or replace table mimiciv_hosp.patients as
+            select
+              subject_id,
+              gender,
+              anchor_age,
+              anchor_year,
+              dod
+            from read_csv(
+              {patients_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              parallel=true,
+              types={{
+                'subject_id': 'BIGINT',
+                'gender': 'VARCHAR',
+                'anchor_age': 'INTEGER',
+                'anchor_year': 'INTEGER',
+                'dod': 'DATE'
+              }}
+            );
+            """,
+        )
+        ddl.append(
+            f"""
+            create or replace table mimiciv_hosp.d_labitems as
+            select
+              itemid,
+              label
+            from read_csv(
+              {d_labitems_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              parallel=true,
+              types={{
+                'itemid': 'INTEGER',
+                'label': 'VARCHAR'
+              }}
+            );
+            """,
+        )
+        # labevents/chartevents/inputevents are stored already restricted to the itemids that
+        # build_analysis_table.sql looks at (keep the lists in sync), so only the matching rows of the big
+        # CSVs are kept.
+        ddl.append(
+            f"""
+            create or replace table mimiciv_hosp.labevents as
+            select
+              hadm_id,
+              itemid,
+              charttime,
+              valuenum
+            from read_csv(
+              {labevents_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              ignore_errors=true,
+              parallel=true,
+              types={{
+                'hadm_id': 'BIGINT',
+                'itemid': 'INTEGER',
+                'charttime': 'TIMESTAMP',
+                'valuenum': 'DOUBLE'
+              }}
+            )
+            where {_LABEVENTS_FILTER};
+            """,
+        )
+        ddl.append(
+            f"""
+            create or replace table mimiciv_hosp.prescriptions as
+            select
+              hadm_id,
+              starttime,
+              stoptime,
+              drug
+            from read_csv(
+              {prescriptions_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              parallel=true,
+              types={{
+                'hadm_id': 'BIGINT',
+                'starttime': 'TIMESTAMP',
+                'stoptime': 'TIMESTAMP',
+                'drug': 'VARCHAR'
+              }}
+            );
+            """,
+        )
+        ddl.append(
+            f"""
+            create or replace table mimiciv_hosp.diagnoses_icd as
+            select
+              hadm_id,
+              icd_code,
+              icd_version
+            from read_csv(
+              {diagnoses_icd_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              parallel=true,
+              types={{
+                'hadm_id': 'BIGINT',
+                'icd_code': 'VARCHAR',
+                'icd_version': 'INTEGER'
+              }}
+            );
+            """,
         )
-        where try_cast(itemid as integer) in (223848, 223849, 229314) and value is not null;
-        """,
-    )
 
-    # For strict CIGIB proxy, we only need PRBC-related inputevents.
-    con.execute(
-        f"""
-        create view mimiciv_icu.inputevents as
-        select
-          try_cast(stay_id as bigint) as stay_id,
-          try_cast(starttime as timestamp) as starttime,
-          try_cast(itemid as integer) as itemid
-        from read_csv_auto(
-          {inputevents_lit},
-          header=true,
-          delim=',',
-          strict_mode=false,
-          null_padding=true
+        # For MV proxy, we only need ventilator mode/type items.
+        ddl.append(
+            f"""
+            create or replace table mimiciv_icu.chartevents as
+            select
+              stay_id,
+              charttime,
+              itemid,
+              value
+            from read_csv(
+              {chartevents_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              ignore_errors=true,
+              parallel=true,
+              types={{
+                'stay_id': 'BIGINT',
+                'charttime': 'TIMESTAMP',
+                'itemid': 'INTEGER',
+                'value': 'VARCHAR'
+              }}
+            )
+            where {_CHARTEVENTS_FILTER};
+            """,
         )
-        where try_cast(itemid as integer) in (220996, 225168, 226368, 227070);
-        """,
-    )
 
-    sql_path = ROOT / "sql" / "mimic" / "build_analysis_table.sql"
-    sql = sql_path.read_text(encoding="utf-8")
+        # For strict CIGIB proxy, we only need PRBC-related inputevents.
+        ddl.append(
+            f"""
+            create or replace table mimiciv_icu.inputevents as
+            select
+              stay_id,
+              starttime,
+              itemid
+            from read_csv(
+              {inputevents_lit},
+              header=true,
+              delim=',',
+              strict_mode=false,
+              null_padding=true,
+              ignore_errors=true,
+              parallel=true,
+              types={{
+                'stay_id': 'BIGINT',
+                'starttime': 'TIMESTAMP',
+                'itemid': 'INTEGER'
+              }}
+            )
+            where {_INPUTEVENTS_FILTER};
+            """,
+        )
+        ddl.append(
+            "create or replace table _source_archive as "
+            f"select {stamp[0]}::bigint as zip_size, {stamp[1]}::bigint as zip_mtime_ns, "
+            f"'{ingest_spec}' as ingest_spec;"
+        )
+        con.execute("\n".join(ddl))
+        con.execute("checkpoint;")
+
     # This SQL file is written as a Postgres template with a 24h landmark; for sensitivity analyses
     # we adjust the landmark and the baseline/exposure window to match landmark_hours.
     sql = sql.replace("interval '24 hour'", f"interval '{landmark_hours} hour'")
+    # The cohort table is per-run output and must not be written into the (possibly read-only) source cache.
+    sql = sql.replace("create table dlfx_mimic_sup_ppi_h2ra as", "create temp table dlfx_mimic_sup_ppi_h2ra as")
     con.execute(sql)
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
     out_lit = _sql_string_literal(out_path)
-    con.execute(f"copy dlfx_mimic_sup_ppi_h2ra to {out_lit} (format parquet);")
+    # COPY returns the number of rows written, so no separate count(*) over the table is needed.
+    n_rows = int(
+        con.execute(
+            f"copy dlfx_mimic_sup_ppi_h2ra to {out_lit} "
+            "(format parquet, compression zstd, compression_level 3, row_group_size 122880);"
+        ).fetchone()[0]
+    )
 
     # Report
-    n_rows = int(con.execute("select count(*) from dlfx_mimic_sup_ppi_h2ra;").fetchone()[0])
-    cols = [r[1] for r in con.execute("pragma table_info('dlfx_mimic_sup_ppi_h2ra');").fetchall()]
+    cols = [r[0] for r in con.execute("describe dlfx_mimic_sup_ppi_h2ra;").fetchall()]
     report = {
         "dataset": "mimic",
         "zip": str(zip_path),
         "out": str(out_path),
         "cache": str(cache_dir),
+        "duckdb_cache": str(db_path),
         "landmark_hours": landmark_hours,
         "n_rows": n_rows,
         "n_cols": len(cols),
@@ -326,12 +604,13 @@ def main() -> None:
     print(text)
 
     if not args.no_validate:
-        import subprocess
+        # Validate in-process against the table still held by DuckDB (no interpreter respawn or
+        # parquet re-read). Like the standalone validator's output, failures are reported, not raised.
+        from dlfx.study import load_config, validate_analysis_table
 
-        subprocess.run(
-            [sys.executable, str(ROOT / "scripts" / "validate_analysis_table.py"), "--input", str(out_path)],
-            check=False,
-        )
+        cfg = load_config(ROOT / "configs" / "study_default.yaml")
+        df = con.execute("select * from dlfx_mimic_sup_ppi_h2ra;").df()
+        print(json.dumps(validate_analysis_table(df, cfg, input_label=str(out_path)), ensure_ascii=False, indent=2))
 
 
 if __name__ == "__main__":
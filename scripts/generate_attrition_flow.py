@@ -2,9 +2,14 @@
 from __future__ import annotations
 
 import argparse
+import csv
+import json
+import os
+import shutil
 from pathlib import Path
 
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT / "src"))
@@ -51,6 +56,17 @@ def parse_args() -> argparse.Namespace:
         default=str(ROOT / "output" / "multicohort_run" / "eicu" / "tables" / "analysis_table_used.parquet"),
         help="If this Parquet exists, final flow n must equal its row count.",
     )
+    p.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="DuckDB threads (default: CPU count, capped at 32).",
+    )
+    p.add_argument(
+        "--memory-limit",
+        default=None,
+        help="DuckDB memory_limit (e.g. 8GB). Default: DuckDB's own limit (80%% of RAM).",
+    )
     return p.parse_args()
 
 
@@ -58,17 +74,136 @@ def _sql_string_literal(path: Path) -> str:
     return "'" + str(path).replace("'", "''") + "'"
 
 
-def _count_parquet(path: Path) -> int:
-    import duckdb  # type: ignore
+_CSV_OPTIONS = "header=true, delim=',', strict_mode=false, null_padding=true"
 
-    con = duckdb.connect(database=":memory:")
-    lit = _sql_string_literal(path)
-    return int(con.execute(f"select count(*) from read_parquet({lit});").fetchone()[0])
+# Case-insensitive drug-name patterns, matched as unanchored substrings (like the ILIKE '%...%' checks they replace).
+_PPI_PATTERN = "omeprazole|pantoprazole|esomeprazole|lansoprazole|rabeprazole"
+_H2RA_PATTERN = "famotidine|ranitidine|cimetidine|nizatidine"
 
 
-def compute_mimic_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
-    import duckdb  # type: ignore
+def _write_tsv(path: Path, header: list[str], rows: list[list]) -> None:
+    with path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _drug_class_sql(table: str, column: str) -> str:
+    """Select the distinct drug names of `table` that are PPIs and/or H2RAs, with 0/1 class flags.
+
+    The regexes then run once per distinct name; the rx steps only hash-join prescriptions on the exact name.
+    """
+    return f"""
+        select drug, is_ppi, is_h2ra
+        from (
+          select
+            {column} as drug,
+            regexp_matches({column}, '{_PPI_PATTERN}', 'i')::integer as is_ppi,
+            regexp_matches({column}, '{_H2RA_PATTERN}', 'i')::integer as is_h2ra
+          from (select distinct {column} from {table} where {column} is not null)
+        )
+        where is_ppi = 1 or is_h2ra = 1
+    """
+
+
+def _parquet_source(
+    con,
+    csv_gz: Path,
+    columns: str,
+    *,
+    csv_options: str = _CSV_OPTIONS,
+    where: str | None = None,
+    order_by: str | None = None,
+) -> str:
+    """Materialize the typed `columns` of a cached csv.gz member as Parquet next to it (once) and return a read_parquet() call.
+
+    The Parquet copy is rebuilt when the csv.gz is newer (e.g. after re-extraction). `where` prefilters the raw CSV
+    rows; `order_by` clusters rows so Parquet min/max statistics can skip row groups. The projection, CSV options,
+    filter and ordering are stored together in the copy's key-value metadata, so changing any of them also triggers
+    a rebuild.
+    """
+    name = csv_gz.name.removesuffix(".csv.gz")
+    target = csv_gz.with_name(f"{name}.parquet")
+    key = json.dumps(
+        {"columns": columns, "csv_options": csv_options, "where": where, "order_by": order_by}, sort_keys=True
+    )
+    stale = not target.is_file() or target.stat().st_mtime < csv_gz.stat().st_mtime
+    if not stale:
+        stored = con.execute(
+            f"select decode(value) from parquet_kv_metadata({_sql_string_literal(target)}) where decode(key) = 'dlfx_source';"
+        ).fetchone()
+        stale = stored is None or stored[0] != key
+    if stale:
+        tmp = csv_gz.with_name(f"{name}.parquet.tmp")
+        for old in (tmp, target):
+            if old.is_dir():
+                shutil.rmtree(old)
+            else:
+                old.unlink(missing_ok=True)
+        query = f"select {columns} from read_csv_auto({_sql_string_literal(csv_gz)}, {csv_options})"
+        options = (
+            "format parquet, compression zstd, row_group_size 122880, "
+            f"kv_metadata {{dlfx_source: {_sql_string_literal(key)}}}"
+        )
+        if where is not None:
+            query += f" where {where}"
+        if order_by is not None:
+            query += f" order by {order_by}"
+        con.execute(f"copy ({query}) to {_sql_string_literal(tmp)} ({options});")
+        tmp.rename(target)
+    return f"read_parquet({_sql_string_literal(target)})"
+
+
+_PLATELET_LABEL_SQL = "label ilike 'Platelet%'"
+_INR_LABEL_SQL = "label ilike 'INR%' or label ilike '%INR%'"
+
+
+def _resolve_lab_itemids(con, d_labitems: Path, cache_file: Path) -> tuple[list[int], list[int]]:
+    """Platelet and INR itemids from d_labitems, memoized in a JSON sidecar.
+
+    The sidecar is reused while it is at least as new as d_labitems.csv.gz and was written for the same label
+    predicates; otherwise d_labitems is scanned again and the sidecar rewritten.
+    """
+    try:
+        if cache_file.stat().st_mtime >= d_labitems.stat().st_mtime:
+            cached = json.loads(cache_file.read_text(encoding="utf-8"))
+            if cached.get("platelet_where") == _PLATELET_LABEL_SQL and cached.get("inr_where") == _INR_LABEL_SQL:
+                return list(cached["platelet"]), list(cached["inr"])
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    d_labitems_src = _parquet_source(con, d_labitems, "itemid::integer as itemid, label::varchar as label")
+    platelet_ids = sorted(int(r[0]) for r in con.execute(f"select distinct itemid from {d_labitems_src} where {_PLATELET_LABEL_SQL};").fetchall())
+    inr_ids = sorted(int(r[0]) for r in con.execute(f"select distinct itemid from {d_labitems_src} where {_INR_LABEL_SQL};").fetchall())
+    if platelet_ids and inr_ids:
+        cache_file.write_text(
+            json.dumps(
+                {"platelet_where": _PLATELET_LABEL_SQL, "inr_where": _INR_LABEL_SQL, "platelet": platelet_ids, "inr": inr_ids},
+                indent=2,
+            )
+            + "\n",
+            encoding="utf-8",
+        )
+    return platelet_ids, inr_ids
 
+
+def _count_parquet(path: Path) -> int:
+    import pyarrow.parquet as pq  # type: ignore
+
+    # Row count straight from the footer metadata; no columns are decoded.
+    meta = pq.ParquetFile(path).metadata
+    # The analysis tables are written by dlfx.io.write_table (pyarrow's default ~1M-row groups). Many small row groups
+    # mean another writer produced the file, and every downstream scan pays per-group overhead with little pruning.
+    if meta.num_row_groups > 1 and meta.num_rows / meta.num_row_groups < 100_000:
+        print(
+            f"warning: {path} has {meta.num_row_groups} row groups for {meta.num_rows} rows; "
+            "rewrite it with row groups of >=100k rows.",
+            file=sys.stderr,
+        )
+    return int(meta.num_rows)
+
+
+def compute_mimic_flow(con, cache_dir: Path, landmark_hours: int) -> list[dict]:
     icu_dir = cache_dir / "icu"
     hosp_dir = cache_dir / "hosp"
 
@@ -84,99 +219,104 @@ def compute_mimic_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
     if missing:
         raise SystemExit(f"MIMIC cache missing files under {cache_dir}: {missing}")
 
-    con = duckdb.connect(database=":memory:")
     con.execute("create schema if not exists mimiciv_icu;")
     con.execute("create schema if not exists mimiciv_hosp;")
 
-    con.execute(
-        f"""
-        create view mimiciv_icu.icustays as
-        select
+    icustays_src = _parquet_source(
+        con,
+        icustays,
+        """
           subject_id::bigint as subject_id,
           hadm_id::bigint as hadm_id,
           stay_id::bigint as stay_id,
           intime::timestamp as intime,
           outtime::timestamp as outtime
-        from read_csv_auto({_sql_string_literal(icustays)}, header=true, delim=',', strict_mode=false, null_padding=true);
-        """
+        """,
     )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.admissions as
-        select
+    con.execute(f"create view mimiciv_icu.icustays as select * from {icustays_src};")
+    admissions_src = _parquet_source(
+        con,
+        admissions,
+        """
           subject_id::bigint as subject_id,
           hadm_id::bigint as hadm_id,
           admittime::timestamp as admittime,
           deathtime::timestamp as deathtime,
           race::varchar as race
-        from read_csv_auto({_sql_string_literal(admissions)}, header=true, delim=',', strict_mode=false, null_padding=true);
-        """
+        """,
     )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.patients as
-        select
+    con.execute(f"create view mimiciv_hosp.admissions as select * from {admissions_src};")
+    patients_src = _parquet_source(
+        con,
+        patients,
+        """
           subject_id::bigint as subject_id,
           gender::varchar as gender,
           anchor_age::integer as anchor_age,
           anchor_year::integer as anchor_year,
           dod::date as dod
-        from read_csv_auto({_sql_string_literal(patients)}, header=true, delim=',', strict_mode=false, null_padding=true);
-        """
-    )
-    con.execute(
-        f"""
-        create view mimiciv_hosp.d_labitems as
-        select
-          itemid::integer as itemid,
-          label::varchar as label
-        from read_csv_auto({_sql_string_literal(d_labitems)}, header=true, delim=',', strict_mode=false, null_padding=true);
-        """
+        """,
     )
-
+    con.execute(f"create view mimiciv_hosp.patients as select * from {patients_src};")
     # Resolve lab itemids once (small table) and then read labevents with an itemid filter to reduce scan cost.
-    platelet_ids = [int(r[0]) for r in con.execute("select distinct itemid from mimiciv_hosp.d_labitems where label ilike 'Platelet%';").fetchall()]
-    inr_ids = [int(r[0]) for r in con.execute("select distinct itemid from mimiciv_hosp.d_labitems where label ilike 'INR%' or label ilike '%INR%';").fetchall()]
+    platelet_ids, inr_ids = _resolve_lab_itemids(con, d_labitems, cache_dir / "_lab_itemids.json")
     if not platelet_ids or not inr_ids:
         raise SystemExit(f"Failed to resolve required lab itemids from {d_labitems}. Platelet={platelet_ids}, INR={inr_ids}")
     lab_itemids = sorted(set(platelet_ids + inr_ids))
     lab_itemids_sql = ",".join(str(x) for x in lab_itemids)
-
+    # itemid -> analyte lookup, so labs_0_lm tags each lab row with one hash join instead of per-row IN lists.
+    lab_itemid_rows = ", ".join([f"({x}, 'platelet')" for x in platelet_ids] + [f"({x}, 'inr')" for x in inr_ids])
     con.execute(
-        f"""
-        create view mimiciv_hosp.labevents as
-        select
+        f"create or replace temp table mimic_lab_itemids as select * from (values {lab_itemid_rows}) t(itemid, analyte);"
+    )
+
+    labevents_src = _parquet_source(
+        con,
+        labevents,
+        """
           try_cast(hadm_id as bigint) as hadm_id,
           try_cast(itemid as integer) as itemid,
           try_cast(charttime as timestamp) as charttime,
           try_cast(valuenum as double) as valuenum
-        from read_csv_auto({_sql_string_literal(labevents)}, header=true, delim=',', strict_mode=false, null_padding=true, all_varchar=true)
-        where try_cast(itemid as integer) in ({lab_itemids_sql});
-        """
+        """,
+        csv_options=_CSV_OPTIONS + ", all_varchar=true",
+        # Only the resolved platelet/INR rows, clustered so the itemid and charttime predicates prune row groups.
+        where=f"try_cast(itemid as integer) in ({lab_itemids_sql})",
+        order_by="itemid, charttime",
     )
     con.execute(
         f"""
-        create view mimiciv_hosp.prescriptions as
-        select
+        create view mimiciv_hosp.labevents as
+        select * from {labevents_src}
+        where itemid in ({lab_itemids_sql});
+        """
+    )
+    prescriptions_src = _parquet_source(
+        con,
+        prescriptions,
+        """
           hadm_id::bigint as hadm_id,
           starttime::timestamp as starttime,
           stoptime::timestamp as stoptime,
           drug::varchar as drug
-        from read_csv_auto({_sql_string_literal(prescriptions)}, header=true, delim=',', strict_mode=false, null_padding=true);
-        """
+        """,
     )
-    con.execute(
-        f"""
-        create view mimiciv_icu.chartevents as
-        select stay_id::bigint as stay_id, charttime::timestamp as charttime, itemid::integer as itemid, value::varchar as value
-        from read_csv_auto({_sql_string_literal(chartevents)}, header=true, delim=',', strict_mode=false, null_padding=true)
-        where itemid in (223848, 223849, 229314) and value is not null;
-        """
+    con.execute(f"create view mimiciv_hosp.prescriptions as select * from {prescriptions_src};")
+    # The MV proxy only needs to know that a ventilation-mode row exists in the window, so the copy keeps just the
+    # matching rows' stay_id/charttime (sorted, for the per-stay EXISTS probe) and drops the wide value column.
+    chartevents_src = _parquet_source(
+        con,
+        chartevents,
+        "stay_id::bigint as stay_id, charttime::timestamp as charttime",
+        where="itemid in (223848, 223849, 229314) and value is not null",
+        order_by="stay_id, charttime",
     )
+    con.execute(f"create view mimiciv_icu.chartevents as select * from {chartevents_src};")
 
+    # alive and sup each feed several downstream steps; materialize them once instead of re-deriving the CTE chain.
     con.execute(
         f"""
-        create table mimic_flow as
+        create or replace temp table mimic_alive as
         with
         icu_stays as (
           select
@@ -196,8 +336,9 @@ def compute_mimic_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
             s.icu_intime,
             s.icu_outtime,
             (s.icu_intime + interval '{int(landmark_hours)} hour') as index_time,
+            index_time::date as index_date,
             (case when s.rn_icu = 1 then 1 else 0 end) as is_first_icu_stay,
-            (case when s.icu_outtime >= (s.icu_intime + interval '{int(landmark_hours)} hour') then 1 else 0 end) as in_icu_at_landmark
+            (case when s.icu_outtime >= index_time then 1 else 0 end) as in_icu_at_landmark
           from icu_stays s
           where s.rn_icu = 1
         ),
@@ -206,7 +347,7 @@ def compute_mimic_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
             b.*,
             p.gender as sex,
             a.race,
-            (p.anchor_age + (date_part('year', a.admittime) - p.anchor_year))::double as age_years,
+            (p.anchor_age + (extract(year from a.admittime)::integer - p.anchor_year))::smallint as age_years,
             p.dod as dod_date,
             a.deathtime as hosp_deathtime
           from base b
@@ -219,24 +360,47 @@ def compute_mimic_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
             (case when d.age_years >= 18 then 1 else 0 end) as adult,
             (case
               when d.hosp_deathtime is not null and d.hosp_deathtime < d.index_time then 0
-              when d.dod_date is not null and d.dod_date < d.index_time::date then 0
+              when d.dod_date is not null and d.dod_date < d.index_date then 0
               else 1
             end) as alive_at_landmark
           from demo d
+        )
+        select * from alive;
+        """
+    )
+    con.execute(
+        """
+        create or replace temp table mimic_sup as
+        with
+        platelet_0_lm as (
+          select a.stay_id, min(le.valuenum) as platelet_min
+          from mimic_alive a
+          join mimiciv_hosp.labevents le
+            on le.hadm_id = a.hadm_id
+           and le.charttime >= a.icu_intime
+           and le.charttime < a.index_time
+          join mimic_lab_itemids li on li.itemid = le.itemid and li.analyte = 'platelet'
+          where le.valuenum is not null
+          group by a.stay_id
         ),
-        labs_0_lm as (
-          select
-            a.stay_id,
-            min(case when le.itemid in ({",".join(str(x) for x in platelet_ids)}) then le.valuenum end) as platelet_min,
-            max(case when le.itemid in ({",".join(str(x) for x in inr_ids)}) then le.valuenum end) as inr_max
-          from alive a
+        inr_0_lm as (
+          select a.stay_id, max(le.valuenum) as inr_max
+          from mimic_alive a
           join mimiciv_hosp.labevents le
             on le.hadm_id = a.hadm_id
            and le.charttime >= a.icu_intime
-           and le.charttime < (a.icu_intime + interval '{int(landmark_hours)} hour')
+           and le.charttime < a.index_time
+          join mimic_lab_itemids li on li.itemid = le.itemid and li.analyte = 'inr'
           where le.valuenum is not null
           group by a.stay_id
         ),
+        -- One scan per analyte: labevents.parquet is sorted by itemid, so the itemid join filter pushed into each
+        -- scan skips the other analyte's row groups.
+        labs_0_lm as (
+          select stay_id, p.platelet_min, i.inr_max
+          from platelet_0_lm p
+          full outer join inr_0_lm i using (stay_id)
+        ),
         coagulopathy as (
           select
             a.stay_id,
@@ -245,46 +409,48 @@ def compute_mimic_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
               when l.inr_max is not null and l.inr_max > 1.5 then 1
               else 0
             end) as sup_indication_coagulopathy
-          from alive a
+          from mimic_alive a
           left join labs_0_lm l on l.stay_id = a.stay_id
         ),
         mv as (
           select
-            a.stay_id,
-            (case when count(ce.stay_id) > 0 then 1 else 0 end) as sup_indication_mv
-          from alive a
-          left join mimiciv_icu.chartevents ce
-            on ce.stay_id = a.stay_id
-           and ce.charttime >= a.icu_intime
-           and ce.charttime < (a.icu_intime + interval '{int(landmark_hours)} hour')
-          group by a.stay_id
+            a.*,
+            (case when exists (
+              select 1
+              from mimiciv_icu.chartevents ce
+              where ce.stay_id = a.stay_id
+                and ce.charttime >= a.icu_intime
+                and ce.charttime < a.index_time
+            ) then 1 else 0 end) as sup_indication_mv
+          from mimic_alive a
         ),
         sup as (
           select
-            a.*,
-            coalesce(mv.sup_indication_mv, 0) as sup_indication_mv,
+            m.*,
             co.sup_indication_coagulopathy,
-            (case when coalesce(mv.sup_indication_mv,0)=1 or co.sup_indication_coagulopathy=1 then 1 else 0 end) as eligible_sup_high_risk
-          from alive a
-          left join mv on mv.stay_id = a.stay_id
-          left join coagulopathy co on co.stay_id = a.stay_id
-        ),
+            (case when m.sup_indication_mv=1 or co.sup_indication_coagulopathy=1 then 1 else 0 end) as eligible_sup_high_risk
+          from mv m
+          left join coagulopathy co on co.stay_id = m.stay_id
+        )
+        select * from sup;
+        """
+    )
+    con.execute(f"create or replace temp table mimic_drug_class as {_drug_class_sql('mimiciv_hosp.prescriptions', 'drug')};")
+    con.execute(
+        """
+        create or replace temp table mimic_flow as
+        with
         rx as (
           select
             s.stay_id,
-            max(case
-              when pr.drug ilike '%omeprazole%' or pr.drug ilike '%pantoprazole%' or pr.drug ilike '%esomeprazole%'
-                or pr.drug ilike '%lansoprazole%' or pr.drug ilike '%rabeprazole%'
-              then 1 else 0 end) as ppi_any,
-            max(case
-              when pr.drug ilike '%famotidine%' or pr.drug ilike '%ranitidine%'
-                or pr.drug ilike '%cimetidine%' or pr.drug ilike '%nizatidine%'
-              then 1 else 0 end) as h2ra_any
-          from sup s
-          left join mimiciv_hosp.prescriptions pr
+            max(dc.is_ppi) as ppi_any,
+            max(dc.is_h2ra) as h2ra_any
+          from mimic_sup s
+          join mimiciv_hosp.prescriptions pr
             on pr.hadm_id = s.hadm_id
-           and pr.starttime < (s.icu_intime + interval '{int(landmark_hours)} hour')
+           and pr.starttime < s.index_time
            and (pr.stoptime is null or pr.stoptime >= s.icu_intime)
+          join mimic_drug_class dc on dc.drug = pr.drug
           group by s.stay_id
         ),
         exposure as (
@@ -298,17 +464,27 @@ def compute_mimic_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
               when coalesce(r.ppi_any,0)=0 and coalesce(r.h2ra_any,0)=1 then 'h2ra'
               else null
             end) as treatment
-          from sup s
+          from mimic_sup s
           left join rx r on r.stay_id = s.stay_id
+        ),
+        stages as (
+          select
+            (adult=1 and is_first_icu_stay=1) as s1,
+            (s1 and in_icu_at_landmark=1 and alive_at_landmark=1) as s2,
+            (s2 and eligible_sup_high_risk=1) as s3,
+            (s3 and dual=1) as e1,
+            (s3 and ppi_any=0 and h2ra_any=0) as e2,
+            (s3 and dual=0 and treatment in ('ppi','h2ra')) as s4
+          from exposure
         )
         select
-          count(*) filter (where adult=1 and is_first_icu_stay=1) as n_adult_first_stay,
-          count(*) filter (where adult=1 and is_first_icu_stay=1 and in_icu_at_landmark=1 and alive_at_landmark=1) as n_landmark_alive_in_icu,
-          count(*) filter (where adult=1 and is_first_icu_stay=1 and in_icu_at_landmark=1 and alive_at_landmark=1 and eligible_sup_high_risk=1) as n_sup_high_risk,
-          count(*) filter (where adult=1 and is_first_icu_stay=1 and in_icu_at_landmark=1 and alive_at_landmark=1 and eligible_sup_high_risk=1 and dual=1) as n_excl_dual,
-          count(*) filter (where adult=1 and is_first_icu_stay=1 and in_icu_at_landmark=1 and alive_at_landmark=1 and eligible_sup_high_risk=1 and ppi_any=0 and h2ra_any=0) as n_excl_neither,
-          count(*) filter (where adult=1 and is_first_icu_stay=1 and in_icu_at_landmark=1 and alive_at_landmark=1 and eligible_sup_high_risk=1 and dual=0 and treatment in ('ppi','h2ra')) as n_final
-        from exposure;
+          coalesce(sum(s1::integer), 0) as n_adult_first_stay,
+          coalesce(sum(s2::integer), 0) as n_landmark_alive_in_icu,
+          coalesce(sum(s3::integer), 0) as n_sup_high_risk,
+          coalesce(sum(e1::integer), 0) as n_excl_dual,
+          coalesce(sum(e2::integer), 0) as n_excl_neither,
+          coalesce(sum(s4::integer), 0) as n_final
+        from stages;
         """
     )
 
@@ -324,9 +500,7 @@ def compute_mimic_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
     ]
 
 
-def compute_eicu_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
-    import duckdb  # type: ignore
-
+def compute_eicu_flow(con, cache_dir: Path, landmark_hours: int) -> list[dict]:
     patient = cache_dir / "patient.csv.gz"
     lab = cache_dir / "lab.csv.gz"
     medication = cache_dir / "medication.csv.gz"
@@ -338,11 +512,10 @@ def compute_eicu_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
 
     lm = int(landmark_hours * 60)
 
-    con = duckdb.connect(database=":memory:")
-    con.execute(
-        f"""
-        create view patient as
-        select
+    patient_src = _parquet_source(
+        con,
+        patient,
+        """
           patientunitstayid::bigint as stay_id,
           uniquepid::varchar as patient_id,
           gender::varchar as sex,
@@ -350,66 +523,59 @@ def compute_eicu_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
           ethnicity::varchar as race,
           unitdischargeoffset::integer as unitdischargeoffset,
           unitdischargestatus::varchar as unitdischargestatus
-        from read_csv_auto({_sql_string_literal(patient)}, header=true, delim=',', strict_mode=false, null_padding=true);
-        """
+        """,
     )
-    con.execute(
-        f"""
-        create view lab as
-        select
+    con.execute(f"create view patient as select * from {patient_src};")
+    lab_src = _parquet_source(
+        con,
+        lab,
+        """
           patientunitstayid::bigint as stay_id,
           labresultoffset::integer as labresultoffset,
           labname::varchar as labname,
           labresult::varchar as labresult
-        from read_csv_auto({_sql_string_literal(lab)}, header=true, delim=',', strict_mode=false, null_padding=true);
-        """
+        """,
     )
-    con.execute(
-        f"""
-        create view medication as
-        select
+    con.execute(f"create view lab as select * from {lab_src};")
+    medication_src = _parquet_source(
+        con,
+        medication,
+        """
           patientunitstayid::bigint as stay_id,
           drugstartoffset::integer as drugstartoffset,
           drugname::varchar as drugname
-        from read_csv_auto({_sql_string_literal(medication)}, header=true, delim=',', strict_mode=false, null_padding=true);
-        """
+        """,
     )
+    con.execute(f"create view medication as select * from {medication_src};")
+
     con.execute(
-        f"""
-        create view diagnosis as
+        """
+        create or replace temp table eicu_base as
         select
-          patientunitstayid::bigint as stay_id,
-          diagnosisoffset::integer as diagnosisoffset,
-          diagnosisstring::varchar as diagnosisstring,
-          icd9code::varchar as icd9code
-        from read_csv_auto({_sql_string_literal(diagnosis)}, header=true, delim=',', strict_mode=false, null_padding=true);
+          p.stay_id,
+          p.patient_id,
+          case
+            when try_cast(p.age as integer) is not null then try_cast(p.age as integer)::double
+            when position('>' in p.age) > 0 then 90::double
+            else null::double
+          end as age_years,
+          p.unitdischargeoffset,
+          p.unitdischargestatus
+        from patient p
+        where coalesce(try_cast(p.age as integer), 90) >= 18;
         """
     )
-
+    con.execute(f"create or replace temp table eicu_drug_class as {_drug_class_sql('medication', 'drugname')};")
     con.execute(
         f"""
-        create table eicu_flow as
+        create or replace temp table eicu_flow as
         with
-        base as (
-          select
-            p.stay_id,
-            p.patient_id,
-            case
-              when try_cast(p.age as integer) is not null then try_cast(p.age as integer)::double
-              when position('>' in p.age) > 0 then 90::double
-              else null::double
-            end as age_years,
-            p.unitdischargeoffset,
-            p.unitdischargestatus
-          from patient p
-          where coalesce(try_cast(p.age as integer), 90) >= 18
-        ),
         labs_0_lm as (
           select
             b.stay_id,
             min(case when l.labname ilike '%platelet%' then try_cast(l.labresult as double) end) as platelet_min,
             max(case when l.labname ilike '%inr%' then try_cast(l.labresult as double) end) as inr_max
-          from base b
+          from eicu_base b
           left join lab l
             on l.stay_id = b.stay_id
            and l.labresultoffset >= 0
@@ -424,14 +590,14 @@ def compute_eicu_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
               when l.inr_max is not null and l.inr_max > 1.5 then 1
               else 0
             end) as sup_indication_coagulopathy
-          from base b
+          from eicu_base b
           left join labs_0_lm l on l.stay_id = b.stay_id
         ),
         mv as (
           select
             b.stay_id,
             0 as sup_indication_mv
-          from base b
+          from eicu_base b
         ),
         sup as (
           select
@@ -439,26 +605,21 @@ def compute_eicu_flow(cache_dir: Path, landmark_hours: int) -> list[dict]:
             mv.sup_indication_mv,
             co.sup_indication_coagulopathy,
             (case when mv.sup_indication_mv=1 or co.sup_indication_coagulopathy=1 then 1 else 0 end) as eligible_sup_high_risk
-          from base b
+          from eicu_base b
           left join mv on mv.stay_id=b.stay_id
           left join coagulopathy co on co.stay_id=b.stay_id
         ),
         rx as (
           select
             s.stay_id,
-            max(case
-              when m.drugname ilike '%omeprazole%' or m.drugname ilike '%pantoprazole%' or m.drugname ilike '%esomeprazole%'
-                or m.drugname ilike '%lansoprazole%' or m.drugname ilike '%rabeprazole%'
-              then 1 else 0 end) as ppi_any,
-            max(case
-              when m.drugname ilike '%famotidine%' or m.drugname ilike '%ranitidine%'
-                or m.drugname ilike '%cimetidine%' or m.drugname ilike '%nizatidine%'
-              then 1 else 0 end) as h2ra_any
+            max(dc.is_ppi) as ppi_any,
+            max(dc.is_h2ra) as h2ra_any
           from sup s
-          left join medication m
+          join medication m
             on m.stay_id = s.stay_id
            and m.drugstartoffset >= 0
            and m.drugstartoffset < {lm}
+          join eicu_drug_class dc on dc.drug = m.drugname
           group by s.stay_id
         ),
         exposure as (
@@ -506,42 +667,58 @@ def main() -> None:
     mimic_cache = Path(args.mimic_cache)
     eicu_cache = Path(args.eicu_cache)
 
-    flow = []
-    flow.extend(compute_mimic_flow(mimic_cache, landmark_hours))
-    flow.extend(compute_eicu_flow(eicu_cache, landmark_hours))
-
-    import pandas as pd
+    import duckdb  # type: ignore
 
-    df = pd.DataFrame(flow, columns=["dataset", "step_id", "step_label", "n", "notes"])
+    # One connection for both cohorts (MIMIC views live in the mimiciv_* schemas, eICU views in main).
+    con = duckdb.connect(database=":memory:")
+    con.execute(f"PRAGMA threads={int(args.threads or min(32, os.cpu_count() or 4))};")
+    if args.memory_limit:
+        con.execute(f"PRAGMA memory_limit={_sql_string_literal(args.memory_limit)};")
+    con.execute("PRAGMA preserve_insertion_order=false;")
+    con.execute("PRAGMA parquet_metadata_cache=true;")
+
+    # The cohorts are independent, so run them concurrently. Each gets its own cursor (temp tables are per cursor);
+    # DuckDB releases the GIL while executing and both queries share the database's thread pool.
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        mimic_future = ex.submit(compute_mimic_flow, con.cursor(), mimic_cache, landmark_hours)
+        eicu_future = ex.submit(compute_eicu_flow, con.cursor(), eicu_cache, landmark_hours)
+        flow = mimic_future.result() + eicu_future.result()
+    con.close()
+
+    columns = ["dataset", "step_id", "step_label", "n", "notes"]
 
     mimic_out = Path(args.mimic_outdir) / "tables"
     eicu_out = Path(args.eicu_outdir) / "tables"
     mimic_out.mkdir(parents=True, exist_ok=True)
     eicu_out.mkdir(parents=True, exist_ok=True)
-    df[df["dataset"] == "mimic"].to_csv(mimic_out / "attrition_flow.tsv", sep="\t", index=False)
-    df[df["dataset"] == "eicu"].to_csv(eicu_out / "attrition_flow.tsv", sep="\t", index=False)
+    _write_tsv(mimic_out / "attrition_flow.tsv", columns, [[r[c] for c in columns] for r in flow if r["dataset"] == "mimic"])
+    _write_tsv(eicu_out / "attrition_flow.tsv", columns, [[r[c] for c in columns] for r in flow if r["dataset"] == "eicu"])
 
-    # Combined pivot for storyboard anchor.
+    # Combined pivot for storyboard anchor: one row per (step_id, step_label), one n_<dataset> column per cohort.
     combined_out = Path(args.multicohort_outdir) / "combined"
     combined_out.mkdir(parents=True, exist_ok=True)
-    pivot = (
-        df.pivot_table(index=["step_id", "step_label"], columns="dataset", values="n", aggfunc="first")
-        .reset_index()
-        .rename(columns={"mimic": "n_mimic", "eicu": "n_eicu"})
+    datasets = sorted({r["dataset"] for r in flow})
+    by_step: dict[tuple[str, str], dict[str, int]] = {}
+    for r in flow:
+        by_step.setdefault((r["step_id"], r["step_label"]), {}).setdefault(r["dataset"], r["n"])
+    _write_tsv(
+        combined_out / "attrition_flow.tsv",
+        ["step_id", "step_label"] + [f"n_{d}" for d in datasets],
+        [[step_id, step_label] + [ns.get(d, "") for d in datasets] for (step_id, step_label), ns in sorted(by_step.items())],
     )
-    pivot.to_csv(combined_out / "attrition_flow.tsv", sep="\t", index=False)
 
     # Guardrail checks against the actual analysis tables used in the run (if present).
+    final_n = {r["dataset"]: int(r["n"]) for r in flow if r["step_id"] == "S4_FINAL"}
     mimic_check = Path(args.check_mimic_analysis_table)
     eicu_check = Path(args.check_eicu_analysis_table)
     if mimic_check.exists():
         expected = _count_parquet(mimic_check)
-        got = int(df[(df["dataset"] == "mimic") & (df["step_id"] == "S4_FINAL")]["n"].iloc[0])
+        got = final_n["mimic"]
         if got != expected:
             raise SystemExit(f"MIMIC final flow n={got} does not match {mimic_check} n={expected}.")
     if eicu_check.exists():
         expected = _count_parquet(eicu_check)
-        got = int(df[(df["dataset"] == "eicu") & (df["step_id"] == "S4_FINAL")]["n"].iloc[0])
+        got = final_n["eicu"]
         if got != expected:
             raise SystemExit(f"eICU final flow n={got} does not match {eicu_check} n={expected}.")
 
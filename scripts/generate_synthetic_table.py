@@ -15,7 +15,11 @@ from dlfx.synthetic import SyntheticConfig, make_synthetic_analysis_table
 
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Generate a synthetic analysis table for smoke testing.")
-    p.add_argument("--out", required=True, help="Output path (.csv or .parquet).")
+    p.add_argument(
+        "--out",
+        required=True,
+        help="Output path; .parquet is preferred (typed, compressed, fast to reload), .csv is also accepted.",
+    )
     p.add_argument("--n", type=int, default=2000, help="Number of synthetic rows.")
     p.add_argument("--seed", type=int, default=11, help="Random seed.")
     return p.parse_args()
@@ -4,6 +4,7 @@ from __future__ import annotations
 import argparse
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 
@@ -36,21 +37,30 @@ def _ensure_dir(p: str | Path) -> Path:
     return p
 
 
-def _panel_df(df: pd.DataFrame, *, rows: list[tuple[str, str]], title_prefix: str) -> pd.DataFrame:
+def _first_by(df: pd.DataFrame, keys: list[str]) -> pd.DataFrame:
+    """First row per `keys` combination, indexed by `keys` for `.loc` lookups."""
+    return df.drop_duplicates(subset=keys).set_index(keys).sort_index()
+
+
+def _lookup(idx: pd.DataFrame, key: tuple) -> pd.Series | None:
+    try:
+        return idx.loc[key]
+    except KeyError:
+        return None
+
+
+def _panel_df(idx: pd.DataFrame, *, rows: list[tuple[str, str]], title_prefix: str) -> pd.DataFrame:
     """
     Build a forest-ready frame with columns: outcome_label, ratio, ratio_lo, ratio_hi.
+    `idx` is `_first_by(df, ["sensitivity_id", "cohort", "outcome"])`.
     `rows` are tuples: (label, sensitivity_id filter key).
     """
     out = []
     for label, sid in rows:
-        sub = df[(df["sensitivity_id"] == sid) & (df["cohort"] == "pooled")].copy()
-        if sub.empty:
-            continue
         # Prefer strict CIGIB rows for panel A.
-        r = sub[sub["outcome"] == "cigib_strict"]
-        if r.empty:
+        rr = _lookup(idx, (sid, "pooled", "cigib_strict"))
+        if rr is None:
             continue
-        rr = r.iloc[0]
         out.append(
             {
                 "outcome_label": f"{title_prefix}{label}",
@@ -67,7 +77,13 @@ def main() -> None:
     summary_path = Path(args.summary)
     outdir = _ensure_dir(args.outdir)
 
-    df = pd.read_csv(summary_path, sep="\t")
+    # Key columns repeat heavily; categorical codes make the isin/index lookups integer work.
+    df = pd.read_csv(
+        summary_path,
+        sep="\t",
+        dtype={"sensitivity_id": "category", "cohort": "category", "outcome": "category"},
+    )
+    idx = _first_by(df, ["sensitivity_id", "cohort", "outcome"])
 
     # Supplement tables (submission-facing tables should be formatted later; these are reproducible anchors).
     strict = df[df["outcome"].isin(["cigib_strict", "cigib_strict_competing_risk_death"])].copy()
@@ -86,14 +102,12 @@ def main() -> None:
         ("Alt exposure definition", "S3_ALT_EXPOSURE_SOURCE"),
         ("Exclude early bleed proxy", "S4_EXCLUDE_EARLY_BLEED"),
     ]
-    a = _panel_df(df, rows=panel_a_rows, title_prefix="")
+    a = _panel_df(idx, rows=panel_a_rows, title_prefix="")
 
     # Panel B: competing risk row (CIF-RR at 14d).
-    bsub = df[(df["sensitivity_id"] == "S6_COMPETING_RISK_DEATH") & (df["cohort"] == "pooled")].copy()
-    b = bsub[bsub["outcome"] == "cigib_strict_competing_risk_death"].copy()
+    rr = _lookup(idx, ("S6_COMPETING_RISK_DEATH", "pooled", "cigib_strict_competing_risk_death"))
     b_row = None
-    if not b.empty:
-        rr = b.iloc[0]
+    if rr is not None:
         b_row = {
             "outcome_label": "Competing risk: death (CIF-RR at 14d)",
             "ratio": float(rr["ratio"]),
@@ -104,18 +118,13 @@ def main() -> None:
     # Optional Panel C: G1 subgroup (MV driver).
     c = None
     if bool(args.include_g1_panel):
-        csub = df[
-            (df["sensitivity_id"] == "G1_SUBGROUP_SUP_DRIVER")
-            & (df["cohort"] == "pooled")
-            & (df["outcome"] == "cigib_strict")
-        ].copy()
+        idx_c = _first_by(df, ["sensitivity_id", "cohort", "outcome", "subgroup_level"])
         labels = {"mv_1": "MV=1", "mv_0": "MV=0"}
         out = []
         for level in ["mv_1", "mv_0"]:
-            r = csub[csub["subgroup_level"] == level]
-            if r.empty:
+            rr = _lookup(idx_c, ("G1_SUBGROUP_SUP_DRIVER", "pooled", "cigib_strict", level))
+            if rr is None:
                 continue
-            rr = r.iloc[0]
             out.append(
                 {
                     "outcome_label": f"Indication driver subgroup: {labels.get(level, level)}",
@@ -135,6 +144,7 @@ def main() -> None:
 
     # Plot (simple, publication draft; journal styling can be adjusted later).
     import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
 
     def forest(ax, d: pd.DataFrame, title: str) -> None:
         if d is None or d.empty:
@@ -142,19 +152,19 @@ def main() -> None:
             return
         dd = d.dropna(subset=["ratio", "ratio_lo", "ratio_hi"]).copy()
         dd = dd.iloc[::-1].reset_index(drop=True)
-        y = range(len(dd))
-        ax.errorbar(
-            dd["ratio"],
-            list(y),
-            xerr=[dd["ratio"] - dd["ratio_lo"], dd["ratio_hi"] - dd["ratio"]],
-            fmt="o",
-            color="black",
-            ecolor="black",
-            capsize=3,
-        )
+        y = np.arange(len(dd), dtype=float)
+        lo = dd["ratio_lo"].to_numpy(dtype=float)
+        hi = dd["ratio_hi"].to_numpy(dtype=float)
+        # One artist each for CI bars, caps and point estimates (errorbar makes a Line2D per part).
+        segs = np.stack([np.column_stack([lo, y]), np.column_stack([hi, y])], axis=1)
+        ax.add_collection(LineCollection(segs, colors="black", linewidths=plt.rcParams["lines.linewidth"]))
+        ax.scatter(np.concatenate([lo, hi]), np.concatenate([y, y]), marker="|", s=6**2, color="black",
+                   linewidths=plt.rcParams["lines.markeredgewidth"])
+        ax.scatter(dd["ratio"], y, s=plt.rcParams["lines.markersize"] ** 2, color="black", zorder=3)
+        ax.autoscale_view()
         ax.axvline(1.0, color="black", linewidth=1)
         ax.set_xscale("log")
-        ax.set_yticks(list(y))
+        ax.set_yticks(y)
         ax.set_yticklabels(dd["outcome_label"])
         ax.set_xlabel("Ratio (log scale)")
         ax.set_title(title)
@@ -11,6 +11,8 @@ from __future__ import annotations
 import argparse
 import hashlib
 import json
+import mmap
+import os
 import platform
 import sys
 from datetime import datetime, timezone
@@ -19,10 +21,10 @@ from typing import Any
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import matplotlib.gridspec as gridspec
 import numpy as np
 import pandas as pd
-from scipy.stats import gaussian_kde
 
 # ── Global rcParams (aligned with PLOT_STYLE_GUIDE.md) ─────────────────────
 mpl.rcParams.update({
@@ -52,13 +54,65 @@ C_PPI = "#4878CF"
 C_H2RA = "#E8853D"
 C_NEUTRAL = "#999999"
 
+PNG_DPI = 300
+
+
+# Only these columns of the run tables feed the board; everything else stays on disk.
+ANALYSIS_COLS = [
+    "treatment_treated", "ps", "iptw",
+    "cigib_strict_time_days", "cigib_strict_event",
+    "death_time_days", "death_event_28d",
+]
+BALANCE_COLS = {"feature", "smd_unweighted", "smd_weighted"}
+EFFECT_COLS = {"outcome", "outcome_label", "effect_type", "horizon_days", "ratio", "ratio_lo", "ratio_hi"}
+
 
 def _sha256(path: Path) -> str:
-    h = hashlib.sha256()
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1 << 16), b""):
-            h.update(chunk)
-    return h.hexdigest()
+        if sys.version_info >= (3, 11):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        h = hashlib.sha256()
+        if os.fstat(f.fileno()).st_size == 0:
+            return h.hexdigest()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+        except (OSError, ValueError):
+            # mmap can be refused (e.g. some network filesystems); fall back to 1 MiB reads.
+            f.seek(0)
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+
+def _memo_dir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "dlfx" / "sha256"
+
+
+def _sha256_memo(path: Path) -> tuple[str, bool]:
+    """_sha256 memoized by size and mtime in a user cache dir (for the large analysis table).
+
+    Returns (digest, from_memo). The memo lives outside the run tree so it never lands in run
+    outputs; a hit trusts the (size, mtime_ns) stamp rather than re-reading the file.
+    """
+    resolved = path.resolve()
+    st = resolved.stat()
+    key = f"{st.st_size} {st.st_mtime_ns}"
+    memo = _memo_dir() / hashlib.sha256(str(resolved).encode("utf-8")).hexdigest()
+    try:
+        digest, _, cached_key = memo.read_text(encoding="utf-8").strip().partition(" ")
+        if cached_key == key:
+            return digest, True
+    except OSError:
+        pass
+    digest = _sha256(resolved)
+    try:
+        memo.parent.mkdir(parents=True, exist_ok=True)
+        memo.write_text(f"{digest} {key}\n", encoding="utf-8")
+    except OSError:
+        # The memo is only an optimisation; an unwritable cache dir just skips it.
+        pass
+    return digest, False
 
 
 def _panel_label(ax: plt.Axes, label: str) -> None:
@@ -66,16 +120,37 @@ def _panel_label(ax: plt.Axes, label: str) -> None:
             fontsize=14, fontweight="bold", va="top", ha="left")
 
 
-def _kish_ess(w: np.ndarray) -> float:
-    s1 = float(np.sum(w))
-    s2 = float(np.sum(w ** 2))
-    return (s1 ** 2) / s2 if s2 > 0 else 0.0
+def _kish_ess_by_arm(t: np.ndarray, w: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Per-arm counts and Kish ESS, indexed by treatment (0=H2RA, 1=PPI)."""
+    n = np.bincount(t, minlength=2)
+    s1 = np.bincount(t, weights=w, minlength=2)
+    s2 = np.bincount(t, weights=w * w, minlength=2)
+    ess = np.divide(s1 ** 2, s2, out=np.zeros_like(s1), where=s2 > 0)
+    return n, ess
+
+
+def _forest_ci(ax: plt.Axes, lo: np.ndarray, hi: np.ndarray, y: np.ndarray, *,
+               color: str, lw: float, capsize: float, zorder: float = 2) -> None:
+    """Horizontal CI bars as one LineCollection, caps as one scatter (errorbar look, two artists)."""
+    lo = np.asarray(lo, dtype=float)
+    hi = np.asarray(hi, dtype=float)
+    y = np.asarray(y, dtype=float)
+    segs = np.stack([np.column_stack([lo, y]), np.column_stack([hi, y])], axis=1)
+    ax.add_collection(LineCollection(segs, colors=color, linewidths=lw, zorder=zorder))
+    ax.scatter(np.concatenate([lo, hi]), np.concatenate([y, y]), marker="|",
+               s=(2 * capsize) ** 2, color=color, linewidths=1.0, zorder=zorder)
+    ax.autoscale_view()
 
 
 def _save_fig(fig: plt.Figure, stem: Path, meta: dict[str, Any]) -> None:
     stem.parent.mkdir(parents=True, exist_ok=True)
-    fig.savefig(stem.with_suffix(".pdf"), bbox_inches="tight")
-    fig.savefig(stem.with_suffix(".png"), dpi=300, bbox_inches="tight")
+    # Probe the tight bbox once (at the PNG dpi, so the raster crop is unchanged) and hand it to
+    # both saves; bbox_inches="tight" would redo the layout pass for each format.
+    fig.set_dpi(PNG_DPI)
+    fig.draw_without_rendering()
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(mpl.rcParams["savefig.pad_inches"])
+    fig.savefig(stem.with_suffix(".pdf"), bbox_inches=bbox)
+    fig.savefig(stem.with_suffix(".png"), dpi=PNG_DPI, bbox_inches=bbox)
     plt.close(fig)
     meta["output_pdf"] = str(stem.with_suffix(".pdf"))
     meta["output_png"] = str(stem.with_suffix(".png"))
@@ -100,49 +175,56 @@ def weighted_km_curve(durations, events, weights):
     t, e, w = t[mask], e[mask], w[mask]
     if t.size == 0:
         return pd.DataFrame(columns=["time", "survival", "n_risk"])
-    df = pd.DataFrame({"time": np.maximum(t, 0), "event": e, "w": w})
-    df = df.sort_values("time").reset_index(drop=True)
-    total_w = float(df["w"].sum())
-    total_n = len(df)
-    g = (df.assign(w_total=df["w"], w_event=df["w"] * (df["event"] == 1))
-         .groupby("time", as_index=False)[["w_total", "w_event"]].sum()
-         .sort_values("time").reset_index(drop=True))
-    surv, risk = 1.0, total_w
-    rows = [{"time": 0.0, "survival": 1.0, "n_risk": total_n}]
-    remaining_n = total_n
-    for _, row in g.iterrows():
-        d = float(row["w_event"])
-        if risk > 0 and d > 0:
-            surv *= max(0.0, 1.0 - d / risk)
-        rows.append({"time": float(row["time"]), "survival": float(surv), "n_risk": remaining_n})
-        # approximate remaining subjects
-        n_at = int((df["time"] == row["time"]).sum())
-        remaining_n -= n_at
-        risk -= float(row["w_total"])
-    return pd.DataFrame(rows)
+    t = np.maximum(t, 0)
+    order = np.argsort(t, kind="stable")
+    t, e, w = t[order], e[order], w[order]
+    total_w = float(w.sum())
+    total_n = t.size
+    times, inv = np.unique(t, return_inverse=True)
+    w_total = np.bincount(inv, weights=w)
+    w_event = np.bincount(inv, weights=w * (e == 1))
+    n_at = np.bincount(inv)
+    # Weight at risk just before each distinct time: total_w minus everything that left at earlier times
+    # (subtract.accumulate keeps the sequential subtraction order of the per-time loop it replaces).
+    risk = np.subtract.accumulate(np.concatenate(([total_w], w_total[:-1])))
+    step = np.ones_like(w_event)
+    hit = (risk > 0) & (w_event > 0)
+    step[hit] = np.maximum(0.0, 1.0 - w_event[hit] / risk[hit])
+    n_risk = total_n - np.concatenate(([0], np.cumsum(n_at)[:-1]))
+    return pd.DataFrame({
+        "time": np.concatenate(([0.0], times)),
+        "survival": np.concatenate(([1.0], np.cumprod(step))),
+        "n_risk": np.concatenate(([total_n], n_risk)),
+    })
 
 
 def make_board(run_dir: Path, outdir: Path) -> None:
     tables_dir = run_dir / "tables"
-    df = pd.read_parquet(tables_dir / "analysis_table_used.parquet")
-    bal = pd.read_csv(tables_dir / "balance_smd.csv")
-    effects = pd.read_csv(tables_dir / "effect_estimates.csv")
+    df = pd.read_parquet(tables_dir / "analysis_table_used.parquet", columns=ANALYSIS_COLS, engine="pyarrow")
+    bal = pd.read_csv(tables_dir / "balance_smd.csv", usecols=lambda c: c in BALANCE_COLS)
+    effects = pd.read_csv(tables_dir / "effect_estimates.csv", usecols=lambda c: c in EFFECT_COLS)
 
     t = df["treatment_treated"].to_numpy(dtype=int)
     ps = df["ps"].to_numpy(dtype=float)
     w = df["iptw"].to_numpy(dtype=float)
-
-    n_ppi = int(np.sum(t == 1))
-    n_h2ra = int(np.sum(t == 0))
-    ess_ppi = _kish_ess(w[t == 1])
-    ess_h2ra = _kish_ess(w[t == 0])
+    # Outcome columns as flat arrays; the KM panels slice them with per-arm masks instead of filtering the frame.
+    cig_t = df["cigib_strict_time_days"].to_numpy(dtype=float)
+    cig_e = df["cigib_strict_event"].to_numpy(dtype=float)
+    dth_t = df["death_time_days"].to_numpy(dtype=float)
+    dth_e = df["death_event_28d"].to_numpy(dtype=float)
+    w_ok = np.isfinite(w)
+    km_arms = [(t == 1, "PPI", C_PPI), (t == 0, "H2RA", C_H2RA)]
+
+    n_by_t, ess_by_t = _kish_ess_by_arm(t, w)
+    n_h2ra, n_ppi = int(n_by_t[0]), int(n_by_t[1])
+    ess_h2ra, ess_ppi = float(ess_by_t[0]), float(ess_by_t[1])
 
     fig = plt.figure(figsize=(7.2, 9.6))
     gs = fig.add_gridspec(3, 2, wspace=0.38, hspace=0.50)
 
     # ── Panel a: Love plot ──
     ax_a = fig.add_subplot(gs[0, 0])
-    bal_sorted = bal.sort_values("smd_unweighted", key=lambda s: s.abs(), ascending=True)
+    bal_sorted = bal.iloc[np.argsort(bal["smd_unweighted"].abs().to_numpy(), kind="stable")]
     y_a = np.arange(len(bal_sorted))
     ax_a.scatter(bal_sorted["smd_unweighted"].abs(), y_a, s=22, color=C_NEUTRAL,
                  label="Unweighted", alpha=0.7, zorder=2)
@@ -160,16 +242,21 @@ def make_board(run_dir: Path, outdir: Path) -> None:
 
     # ── Panel b: PS overlap (IPTW-weighted) ──
     ax_b = fig.add_subplot(gs[0, 1])
-    ps_ppi = ps[t == 1]
-    ps_h2ra = ps[t == 0]
-    w_ppi = w[t == 1]
-    w_h2ra = w[t == 0]
+    # Histograms use finite weights only (as the KM panels do); a NaN weight would poison every bin.
+    ppi_ok = (t == 1) & w_ok
+    h2ra_ok = (t == 0) & w_ok
+    ps_ppi = ps[ppi_ok]
+    ps_h2ra = ps[h2ra_ok]
+    w_ppi = w[ppi_ok]
+    w_h2ra = w[h2ra_ok]
 
     bins = np.linspace(0, 1, 60)
-    ax_b.hist(ps_h2ra, bins=bins, weights=w_h2ra, alpha=0.45, color=C_H2RA,
-              label=f"H2RA (n={n_h2ra})", density=True)
-    ax_b.hist(ps_ppi, bins=bins, weights=w_ppi, alpha=0.45, color=C_PPI,
-              label=f"PPI (n={n_ppi})", density=True)
+    h_h2ra, _ = np.histogram(ps_h2ra, bins, weights=w_h2ra, density=True)
+    h_ppi, _ = np.histogram(ps_ppi, bins, weights=w_ppi, density=True)
+    ax_b.stairs(h_h2ra, bins, fill=True, alpha=0.45, color=C_H2RA,
+                label=f"H2RA (n={n_h2ra})")
+    ax_b.stairs(h_ppi, bins, fill=True, alpha=0.45, color=C_PPI,
+                label=f"PPI (n={n_ppi})")
     ax_b.set_xlabel("Propensity score")
     ax_b.set_ylabel("Density (IPTW-weighted)")
     ax_b.legend(frameon=False, fontsize=7)
@@ -177,8 +264,12 @@ def make_board(run_dir: Path, outdir: Path) -> None:
 
     # ── Panel c: IPTW distribution ──
     ax_c = fig.add_subplot(gs[1, 0])
-    ax_c.hist(w[t == 0], bins=60, alpha=0.45, color=C_H2RA, density=True, label="H2RA")
-    ax_c.hist(w[t == 1], bins=60, alpha=0.45, color=C_PPI, density=True, label="PPI")
+    # Shared edges so the two arms are binned identically.
+    w_bins = np.histogram_bin_edges(w[w_ok], bins=60)
+    h_h2ra, _ = np.histogram(w_h2ra, w_bins, density=True)
+    h_ppi, _ = np.histogram(w_ppi, w_bins, density=True)
+    ax_c.stairs(h_h2ra, w_bins, fill=True, alpha=0.45, color=C_H2RA, label="H2RA")
+    ax_c.stairs(h_ppi, w_bins, fill=True, alpha=0.45, color=C_PPI, label="PPI")
     ax_c.set_xlabel("IPTW weight")
     ax_c.set_ylabel("Density")
     ax_c.legend(frameon=False, fontsize=7)
@@ -193,16 +284,12 @@ def make_board(run_dir: Path, outdir: Path) -> None:
     if not primary.empty:
         horizon_primary = float(primary.iloc[0]["horizon_days"])
 
-    for g_val, label, color in [(1, "PPI", C_PPI), (0, "H2RA", C_H2RA)]:
-        sub = df[df["treatment_treated"] == g_val].dropna(
-            subset=["cigib_strict_time_days", "cigib_strict_event", "iptw"])
-        if sub.empty:
+    ok = np.isfinite(cig_t) & np.isfinite(cig_e) & w_ok
+    for arm, label, color in km_arms:
+        m = arm & ok
+        if not m.any():
             continue
-        curve = weighted_km_curve(
-            sub["cigib_strict_time_days"].to_numpy(),
-            sub["cigib_strict_event"].to_numpy(),
-            sub["iptw"].to_numpy(),
-        )
+        curve = weighted_km_curve(cig_t[m], cig_e[m], w[m])
         curve = curve[curve["time"] <= horizon_primary]
         ax_d.step(curve["time"], curve["survival"], where="post", label=label, color=color, lw=1.5)
 
@@ -229,16 +316,12 @@ def make_board(run_dir: Path, outdir: Path) -> None:
     if not death_row.empty:
         horizon_death = float(death_row.iloc[0]["horizon_days"])
 
-    for g_val, label, color in [(1, "PPI", C_PPI), (0, "H2RA", C_H2RA)]:
-        sub = df[df["treatment_treated"] == g_val].dropna(
-            subset=["death_time_days", "death_event_28d", "iptw"])
-        if sub.empty:
+    ok = np.isfinite(dth_t) & np.isfinite(dth_e) & w_ok
+    for arm, label, color in km_arms:
+        m = arm & ok
+        if not m.any():
             continue
-        curve = weighted_km_curve(
-            sub["death_time_days"].to_numpy(),
-            sub["death_event_28d"].to_numpy(),
-            sub["iptw"].to_numpy(),
-        )
+        curve = weighted_km_curve(dth_t[m], dth_e[m], w[m])
         curve = curve[curve["time"] <= horizon_death]
         ax_e.step(curve["time"], curve["survival"], where="post", label=label, color=color, lw=1.5)
 
@@ -263,17 +346,11 @@ def make_board(run_dir: Path, outdir: Path) -> None:
     if not ef.empty:
         ef = ef.iloc[::-1].reset_index(drop=True)
         y_f = np.arange(len(ef))
-        xerr_lo = ef["ratio"] - ef["ratio_lo"]
-        xerr_hi = ef["ratio_hi"] - ef["ratio"]
-
-        ax_f.errorbar(ef["ratio"], y_f,
-                      xerr=[xerr_lo, xerr_hi],
-                      fmt="none", ecolor="#555555", capsize=3, lw=0.8, zorder=2)
+        ratio = ef["ratio"].to_numpy(dtype=float)
 
-        for i, (_, row) in enumerate(ef.iterrows()):
-            col = "#D65F5F" if row["ratio"] > 1 else C_PPI
-            ax_f.scatter(row["ratio"], y_f[i], s=55, color=col, zorder=3,
-                         edgecolors="white", lw=0.4)
+        _forest_ci(ax_f, ef["ratio_lo"], ef["ratio_hi"], y_f, color="#555555", lw=0.8, capsize=3)
+        ax_f.scatter(ratio, y_f, s=55, color=np.where(ratio > 1, "#D65F5F", C_PPI), zorder=3,
+                     edgecolors="white", lw=0.4)
 
         ax_f.axvline(1.0, color="black", lw=0.9)
         ax_f.set_xscale("log")
@@ -301,9 +378,16 @@ def make_board(run_dir: Path, outdir: Path) -> None:
         "effect_estimates": str(tables_dir / "effect_estimates.csv"),
     }
     checksums = {}
+    memoized = []
     for k, p in input_files.items():
         pp = Path(p)
-        if pp.exists():
+        if not pp.exists():
+            continue
+        if k == "analysis_table":
+            checksums[k], hit = _sha256_memo(pp)
+            if hit:
+                memoized.append(k)
+        else:
             checksums[k] = _sha256(pp)
 
     meta = {
@@ -319,6 +403,8 @@ def make_board(run_dir: Path, outdir: Path) -> None:
         ],
         "inputs": input_files,
         "input_checksums": checksums,
+        # Checksums taken from the size/mtime memo rather than a fresh read of the file.
+        "input_checksums_memoized": memoized,
         "sample_sizes": {
             "n_ppi": n_ppi, "n_h2ra": n_h2ra,
             "ess_ppi": round(ess_ppi, 1), "ess_h2ra": round(ess_h2ra, 1),
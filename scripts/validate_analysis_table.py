@@ -7,13 +7,11 @@ from pathlib import Path
 
 import sys
 
-import pandas as pd
-
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT / "src"))
 
 from dlfx.io import read_table
-from dlfx.study import load_config
+from dlfx.study import load_config, validate_analysis_table
 
 
 def parse_args() -> argparse.Namespace:
@@ -33,40 +31,7 @@ def main() -> None:
     cfg = load_config(args.config)
     df = read_table(args.input)
 
-    report: dict = {"input": str(args.input), "n_rows": int(df.shape[0]), "n_cols": int(df.shape[1])}
-    missing_cov = [c for c in cfg.covariates if c not in df.columns]
-    report["missing_covariates"] = missing_cov
-
-    outcome_checks = []
-    for o in cfg.outcomes:
-        ok_event = o.event_col in df.columns and pd.to_numeric(df[o.event_col], errors="coerce").notna().any()
-        ok_time = True
-        if o.time_col is not None:
-            time_series = pd.to_numeric(df[o.time_col], errors="coerce") if o.time_col in df.columns else None
-            if o.required:
-                ok_time = time_series is not None and time_series.notna().all()
-            else:
-                ok_time = time_series is not None and time_series.notna().any()
-        outcome_checks.append(
-            {
-                "name": o.name,
-                "required": o.required,
-                "event_col": o.event_col,
-                "time_col": o.time_col,
-                "event_col_ok": bool(ok_event),
-                "time_col_ok": bool(ok_time),
-            }
-        )
-    report["outcomes"] = outcome_checks
-
-    # Hard fail conditions
-    failures = []
-    if cfg.treatment_col not in df.columns:
-        failures.append(f"missing_treatment_col:{cfg.treatment_col}")
-    for oc in outcome_checks:
-        if oc["required"] and not oc["event_col_ok"]:
-            failures.append(f"missing_required_outcome_event:{oc['name']}:{oc['event_col']}")
-    report["failures"] = failures
+    report = validate_analysis_table(df, cfg, input_label=str(args.input))
 
     text = json.dumps(report, ensure_ascii=False, indent=2)
     if args.out:
@@ -74,7 +39,7 @@ def main() -> None:
         Path(args.out).write_text(text, encoding="utf-8")
     print(text)
 
-    if failures:
+    if report["failures"]:
         raise SystemExit(2)
 
 
@@ -114,6 +114,48 @@ def load_config(path: str | Path) -> StudyConfig:
     )
 
 
+def validate_analysis_table(df: pd.DataFrame, cfg: StudyConfig, *, input_label: str) -> dict[str, Any]:
+    """
+    Check an extracted analysis table against the study config. The returned report lists
+    hard-fail conditions under "failures" (empty when the table is usable).
+    """
+    report: dict[str, Any] = {"input": input_label, "n_rows": int(df.shape[0]), "n_cols": int(df.shape[1])}
+    missing_cov = [c for c in cfg.covariates if c not in df.columns]
+    report["missing_covariates"] = missing_cov
+
+    outcome_checks = []
+    for o in cfg.outcomes:
+        ok_event = o.event_col in df.columns and pd.to_numeric(df[o.event_col], errors="coerce").notna().any()
+        ok_time = True
+        if o.time_col is not None:
+            time_series = pd.to_numeric(df[o.time_col], errors="coerce") if o.time_col in df.columns else None
+            if o.required:
+                ok_time = time_series is not None and time_series.notna().all()
+            else:
+                ok_time = time_series is not None and time_series.notna().any()
+        outcome_checks.append(
+            {
+                "name": o.name,
+                "required": o.required,
+                "event_col": o.event_col,
+                "time_col": o.time_col,
+                "event_col_ok": bool(ok_event),
+                "time_col_ok": bool(ok_time),
+            }
+        )
+    report["outcomes"] = outcome_checks
+
+    # Hard fail conditions
+    failures = []
+    if cfg.treatment_col not in df.columns:
+        failures.append(f"missing_treatment_col:{cfg.treatment_col}")
+    for oc in outcome_checks:
+        if oc["required"] and not oc["event_col_ok"]:
+            failures.append(f"missing_required_outcome_event:{oc['name']}:{oc['event_col']}")
+    report["failures"] = failures
+    return report
+
+
 def _weight_summary(df: pd.DataFrame, *, weight_col: str, treat_col: str) -> dict[str, Any]:
     w = df[weight_col].to_numpy(dtype=float)
     t = df[treat_col].to_numpy(dtype=int)
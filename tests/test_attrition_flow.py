@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import gzip
+import importlib.util
+import os
+from pathlib import Path
+
+import duckdb
+
+
+def _load_flow():
+    root = Path(__file__).resolve().parents[1]
+    spec = importlib.util.spec_from_file_location("generate_attrition_flow", root / "scripts" / "generate_attrition_flow.py")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _write_csv_gz(path: Path, rows: list[tuple[int, str]], mtime: int) -> None:
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write("itemid,label\n")
+        f.writelines(f"{i},{label}\n" for i, label in rows)
+    os.utime(path, (mtime, mtime))
+
+
+def test_parquet_source_rebuilds_on_newer_csv_or_new_key(tmp_path: Path) -> None:
+    flow = _load_flow()
+    csv_gz = tmp_path / "d_labitems.csv.gz"
+    target = tmp_path / "d_labitems.parquet"
+    columns = "itemid::integer as itemid, label::varchar as label"
+    _write_csv_gz(csv_gz, [(1, "Platelet Count"), (2, "INR(PT)")], mtime=1_000_000)
+
+    with duckdb.connect() as con:
+        src = flow._parquet_source(con, csv_gz, columns)
+        assert con.execute(f"select count(*) from {src};").fetchone()[0] == 2
+        built = target.stat().st_mtime_ns
+
+        # Same csv.gz and same key: the cached copy is reused as is.
+        flow._parquet_source(con, csv_gz, columns)
+        assert target.stat().st_mtime_ns == built
+
+        # A re-extracted (newer) csv.gz invalidates the copy.
+        _write_csv_gz(csv_gz, [(1, "Platelet Count"), (2, "INR(PT)"), (3, "Lactate")], mtime=target.stat().st_mtime + 10)
+        src = flow._parquet_source(con, csv_gz, columns)
+        assert con.execute(f"select count(*) from {src};").fetchone()[0] == 3
+
+        # A different filter changes the stored key and triggers a rebuild even though the csv.gz is older.
+        src = flow._parquet_source(con, csv_gz, columns, where="itemid <> 2")
+        assert con.execute(f"select list(itemid order by itemid) from {src};").fetchone()[0] == [1, 3]
+        assert not target.with_name("d_labitems.parquet.tmp").exists()
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import importlib.util
+import zipfile
+from pathlib import Path
+
+import pytest
+
+
+def _load_extract():
+    root = Path(__file__).resolve().parents[1]
+    spec = importlib.util.spec_from_file_location("extract_mimic_duckdb", root / "scripts" / "extract_mimic_duckdb.py")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _make_zip(path: Path, payload: bytes, compression: int) -> None:
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("hosp/labevents.csv.gz", payload, compress_type=compression)
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_extract_member_meta_sidecar(tmp_path: Path, compression: int) -> None:
+    ext = _load_extract()
+    member = "hosp/labevents.csv.gz"
+    dest = tmp_path / "cache" / "labevents.csv.gz"
+    meta = dest.with_name(dest.name + ".meta")
+    zip_a, zip_b = tmp_path / "a.zip", tmp_path / "b.zip"
+    _make_zip(zip_a, b"A" * 4096, compression)
+    # Same size, different bytes: only the CRC in the sidecar tells the two archives apart.
+    _make_zip(zip_b, b"B" * 4096, compression)
+
+    with zipfile.ZipFile(zip_a) as zf:
+        ext._extract_member(zf, member, dest)
+        info = zf.getinfo(member)
+        assert dest.read_bytes() == b"A" * 4096
+        assert meta.read_text() == f"{info.CRC:08x} {info.file_size}\n"
+
+        # Matching sidecar: the cached copy is reused without rewriting it.
+        extracted = dest.stat().st_mtime_ns
+        ext._extract_member(zf, member, dest)
+        assert dest.stat().st_mtime_ns == extracted
+
+        # A truncated copy no longer matches the recorded size and is extracted again.
+        dest.write_bytes(b"A" * 10)
+        ext._extract_member(zf, member, dest)
+        assert dest.read_bytes() == b"A" * 4096
+
+    with zipfile.ZipFile(zip_b) as zf:
+        ext._extract_member(zf, member, dest)
+        assert dest.read_bytes() == b"B" * 4096
+        assert meta.read_text().startswith(f"{zf.getinfo(member).CRC:08x} ")
+
+        # Pre-sidecar caches are adopted only when their CRC matches the member.
+        meta.unlink()
+        ext._extract_member(zf, member, dest)
+        assert meta.exists()
+        meta.unlink()
+        dest.write_bytes(b"C" * 4096)
+        ext._extract_member(zf, member, dest)
+        assert dest.read_bytes() == b"B" * 4096
+        assert meta.exists()
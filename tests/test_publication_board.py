@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+
+
+def _load_board():
+    root = Path(__file__).resolve().parents[1]
+    spec = importlib.util.spec_from_file_location("make_publication_board", root / "scripts" / "make_publication_board.py")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def test_weighted_km_curve_matches_hand_computed_curve() -> None:
+    board = _load_board()
+    # Unsorted input with a tie at t=2 (one event, one censored) and a non-finite row that must be dropped.
+    km = board.weighted_km_curve(
+        durations=[3.0, 1.0, 2.0, 2.0, np.nan],
+        events=[1, 1, 0, 1, 1],
+        weights=[2.0, 1.0, 2.0, 1.0, 5.0],
+    )
+    # Total weight 6: t=1 removes 1/6; t=2 has 5 at risk and 1 event; t=3 has the last 2 at risk, both events.
+    np.testing.assert_allclose(km["time"], [0.0, 1.0, 2.0, 3.0])
+    np.testing.assert_allclose(km["survival"], [1.0, 5 / 6, 5 / 6 * 4 / 5, 0.0])
+    assert km["n_risk"].tolist() == [4, 4, 3, 1]
+
+
+def test_weighted_km_curve_empty_input() -> None:
+    board = _load_board()
+    km = board.weighted_km_curve([], [], [])
+    assert km.empty
+    assert list(km.columns) == ["time", "survival", "n_risk"]
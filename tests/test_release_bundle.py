@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+
+def _load_bundle():
+    root = Path(__file__).resolve().parents[1]
+    spec = importlib.util.spec_from_file_location("build_release_bundle", root / "scripts" / "build_release_bundle.py")
+    mod = importlib.util.module_from_spec(spec)
+    # Registered before exec: the script's dataclasses resolve their module through sys.modules.
+    sys.modules[spec.name] = mod
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def test_zip_entries_checksums_match_zip_contents(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    bundle = _load_bundle()
+    # Shrink the limits so a handful of small files covers the streamed path and the read-ahead byte cap.
+    monkeypatch.setattr(bundle, "_STREAM_MIN_BYTES", 64 * 1024)
+    monkeypatch.setattr(bundle, "_MAX_INFLIGHT_BYTES", 96 * 1024)
+
+    src = tmp_path / "src"
+    src.mkdir()
+    entries: list[tuple[str, Path | bytes]] = [("README_REPRODUCE.md", b"# Reproduction Guide\n")]
+    sizes = {"a.csv": 40 * 1024, "b.csv": 50 * 1024, "c.py": 0, "fig.png": 30 * 1024, "big.tsv": 300 * 1024}
+    for name, size in sizes.items():
+        p = src / name
+        p.write_bytes(os.urandom(size // 2) + b"x" * (size - size // 2))
+        entries.append((f"repo/{name}", p))
+
+    zip_path = tmp_path / "bundle.zip"
+    checksums = bundle._zip_entries(zip_path, entries)
+
+    assert [rel for rel, _ in checksums] == sorted(rel for rel, _ in entries)
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [rel for rel, _ in checksums]
+        for rel, digest in checksums:
+            assert hashlib.sha256(zf.read(rel)).hexdigest() == digest
+        assert zf.getinfo("repo/fig.png").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("repo/big.tsv").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo("repo/big.tsv").file_size == sizes["big.tsv"]
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from dlfx.ps import PSConfig
+from dlfx.study import OutcomeSpec, StudyConfig, validate_analysis_table
+
+
+def _config() -> StudyConfig:
+    return StudyConfig(
+        treatment_col="treatment",
+        treated_label="ppi",
+        control_label="h2ra",
+        covariates=["age_years", "sofa_24h"],
+        ps=PSConfig(),
+        outcomes=[
+            OutcomeSpec("cigib_strict", "Strict CIGIB", "cigib_strict_event", "cigib_strict_time_days", 14.0, required=True),
+            OutcomeSpec("death", "Mortality", "death_event_28d", "death_time_days", 28.0),
+        ],
+    )
+
+
+def test_validate_analysis_table_accepts_complete_table() -> None:
+    df = pd.DataFrame(
+        {
+            "treatment": ["ppi", "h2ra", "ppi"],
+            "age_years": [61.0, 70.0, 55.0],
+            "sofa_24h": [4, 7, 2],
+            "cigib_strict_event": [0, 1, 0],
+            "cigib_strict_time_days": [14.0, 3.5, 14.0],
+            "death_event_28d": [0, 0, 1],
+            "death_time_days": [28.0, 28.0, np.nan],
+        }
+    )
+    report = validate_analysis_table(df, _config(), input_label="ok.parquet")
+    assert report["failures"] == []
+    assert report["missing_covariates"] == []
+    assert (report["n_rows"], report["n_cols"]) == (3, 7)
+    assert all(o["event_col_ok"] and o["time_col_ok"] for o in report["outcomes"])
+
+
+def test_validate_analysis_table_reports_failures() -> None:
+    # No treatment column, one covariate missing, and the required outcome's event column is entirely null.
+    df = pd.DataFrame(
+        {
+            "age_years": [61.0, 70.0],
+            "cigib_strict_event": [np.nan, np.nan],
+            "cigib_strict_time_days": [14.0, np.nan],
+            "death_event_28d": [0, 1],
+        }
+    )
+    report = validate_analysis_table(df, _config(), input_label="bad.parquet")
+    assert report["failures"] == [
+        "missing_treatment_col:treatment",
+        "missing_required_outcome_event:cigib_strict:cigib_strict_event",
+    ]
+    assert report["missing_covariates"] == ["sofa_24h"]
+    cigib, death = report["outcomes"]
+    assert not cigib["event_col_ok"] and not cigib["time_col_ok"]
+    assert death["event_col_ok"] and not death["time_col_ok"]